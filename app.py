@@ -5,26 +5,63 @@ A minimal personal website featuring retro visual effects,
 social links, and blog posts.
 """
 
-import frontmatter
+import hmac
+import ipaddress
+import json
+import os
+import time
+from functools import wraps
 from pathlib import Path
-from datetime import datetime
 from fasthtml.common import *
-from monsterui.all import render_md
+from starlette.concurrency import run_in_threadpool
 
 from components import TerminalBox, ThemeSwitcher, theme_script
+from services import AssetResponse, Cache, MemoryBudget, RouteClass, RenderPool, Site, SiteRouter
+from services.assets import IMMUTABLE, asset_url
+from services.api import (
+    ALL_FIELDS, LIST_FIELDS, MAX_PER_PAGE, ApiError,
+    dumps, etag, etag_matches, filter_posts, parse_date, parse_fields, post_fields,
+)
 
 # ============================================
 # Application Setup
 # ============================================
 
-css_files = [
-    Link(rel="stylesheet", href="/static/css/terminal.css"),
-    Link(rel="stylesheet", href="/static/css/effects.css"),
-    Link(rel="stylesheet", href="/static/css/borders.css"),
-    Link(rel="stylesheet", href="/static/css/themes/cyberpunk.css"),
-    Link(rel="stylesheet", href="/static/css/themes/darcula.css"),
-    Link(rel="stylesheet", href="/static/css/themes/nordic.css"),
-    Link(rel="stylesheet", href="/static/css/themes/light.css"),
+CSS_SOURCES = [
+    "terminal.css",
+    "effects.css",
+    "borders.css",
+    "themes/cyberpunk.css",
+    "themes/darcula.css",
+    "themes/nordic.css",
+    "themes/light.css",
+]
+
+CSS_MANIFEST = Path("static/css/build/manifest.json")
+
+
+def load_css_build():
+    """Manifest written by build_css.py, unless missing or older than anything it was built from."""
+    if not CSS_MANIFEST.exists():
+        return None
+    built = CSS_MANIFEST.stat().st_mtime
+    # Markup and scripts decide which rules survive pruning, not just the CSS
+    inputs = [
+        *(Path("static/css") / f for f in CSS_SOURCES),
+        Path(__file__),
+        *Path("components").glob("*.py"),
+        *Path("static/js").glob("*.js"),
+    ]
+    if any(p.stat().st_mtime > built for p in inputs):
+        return None
+    return json.loads(CSS_MANIFEST.read_text())
+
+
+css_build = load_css_build()
+
+# With a build, each page inlines its critical CSS and defers the bundle (see layout)
+css_files = [] if css_build else [
+    Link(rel="stylesheet", href=f"/static/css/{f}") for f in CSS_SOURCES
 ]
 
 fonts = [
@@ -122,30 +159,69 @@ def hx_link(text, href, cls="", **kwargs):
     return A(text, href=href, hx_get=href, cls=cls, **hx_attrs(), **kwargs)
 
 
-class Post:
-    def __init__(self, path):
-        self.path = Path(path)
-        self.slug = self.path.stem
-        post = frontmatter.load(path)
-        self.content = post.content
-        self.meta = post.metadata
-        self.title = self.meta.get('title', 'Untitled')
-        self.date = self.meta.get('date', datetime.now())
-        self.excerpt = self.meta.get('excerpt', '')
-        self.tags = self.meta.get('tags', [])
-        self.datestr = self.date.strftime('%Y-%m-%d')
-
-
-def get_posts(n=None):
-    posts_dir = Path('posts')
-    if not posts_dir.exists():
-        return []
-    posts = sorted(
-        [Post(p) for p in posts_dir.glob('*.md')],
-        key=lambda p: p.date,
-        reverse=True
+# ============================================
+# Memory Budget
+# ============================================
+
+# Every in-process cache, and every site's parsed posts, draws on this one
+# budget. Size it to what the container can spare beyond the interpreter,
+# libraries and render workers.
+MEMORY = MemoryBudget(64 * 2**20)
+
+
+# ============================================
+# Admission Control
+# ============================================
+
+# Uncached post renders are the expensive path; listings build every card.
+# Keep limit + queue well under the threadpool size so cheap routes
+# (static files, status) always have threads available during a spike.
+RENDER = RouteClass('render', limit=8, queue=16, timeout=2.0,
+                    stale=Cache('render:stale', MEMORY, 4 * 2**20))
+LISTING = RouteClass('listing', limit=16, queue=32, timeout=2.0,
+                     stale=Cache('listing:stale', MEMORY, 4 * 2**20))
+ROUTE_CLASSES = [RENDER, LISTING]
+
+
+# ============================================
+# Markdown Rendering
+# ============================================
+
+# Rendering happens in worker processes shared by all sites; a post that is
+# too large or too slow to render is shown as escaped source rather than
+# stalling the request. Rendered HTML lives in each site's own cache.
+RENDERER = RenderPool(workers=2, timeout=2.0, max_bytes=512_000)
+# Boot the workers before serving so the first renders don't wait on them
+app.router.on_startup.append(lambda: RENDERER.start(wait=True))
+app.router.on_shutdown.append(RENDERER.shutdown)
+
+
+def render_post(site, p):
+    # Asset hashes are part of the key: replacing an image re-renders the post
+    key = (site.name, p.slug, p.mtime, site.assets.version(p.slug))
+    return NotStr(RENDERER.render(key, p.content, site.render_cache, site.assets.urls(p.slug)))
+
+
+# ============================================
+# Related Posts
+# ============================================
+
+def related_posts(site, slug):
+    related = site.posts.related(slug)
+    if not related:
+        return None
+
+    return Div(
+        H2("Related Posts", cls="text-lg font-semibold mb-4"),
+        Div(
+            *[Div(
+                hx_link(p.title, f"/blog/{p.slug}", cls="block"),
+                cls="blog-card"
+            ) for p in related],
+            cls="grid gap-4"
+        ),
+        cls="mb-8"
     )
-    return posts[:n] if n else posts
 
 
 # ============================================
@@ -159,7 +235,7 @@ SOCIALS = [
 ]
 
 
-def social_links():
+def social_links(site):
     return Div(
         *[A(
             Span(s['name']),
@@ -167,11 +243,52 @@ def social_links():
             target="_blank",
             rel="noopener noreferrer",
             cls="social-link"
-        ) for s in SOCIALS],
+        ) for s in site.socials],
         cls="flex flex-wrap gap-4 justify-center"
     )
 
 
+# ============================================
+# Sites
+# ============================================
+
+# Every site served by this process, picked by Host header. Hosts that match
+# no site get the first one.
+SITES = SiteRouter([
+    Site(
+        'preswick',
+        hosts=['localhost', '127.0.0.1'],
+        posts_dir='posts',
+        socials=SOCIALS,
+        default_theme='cyberpunk',
+        title='Robbie Preswick',
+        brand='RP',
+        tagline='Builder of things.',
+        budget=MEMORY,
+    ),
+])
+
+
+def resolve_site(req):
+    site = SITES.resolve(req.headers.get('host'))
+    site.requests += 1
+    req.scope['site'] = site
+    # Read by theme_script() before the page renders
+    req.htmlkw['data_default_theme'] = site.default_theme
+
+
+app.before.append(Beforeware(resolve_site))
+
+
+def load_sites():
+    """Parse every site's posts before serving, so no request pays for the first scan."""
+    for site in SITES:
+        site.posts.refresh(force=True)
+
+
+app.router.on_startup.append(load_sites)
+
+
 # ============================================
 # Effect Controls
 # ============================================
@@ -195,9 +312,9 @@ def effect_controls():
 # Layout
 # ============================================
 
-def navbar():
+def navbar(site):
     brand = A(
-        Span("RP", cls="font-bold text-accent-primary"),
+        Span(site.brand, cls="font-bold text-accent-primary"),
         href="/", hx_get="/",
         cls="text-lg",
         **hx_attrs()
@@ -220,8 +337,18 @@ def navbar():
     )
 
 
-def layout(*content, title=None, htmx=None, show_effects=True):
-    page_title = f"{title}" if title else "Robbie Preswick"
+def page_css(page):
+    """Inline critical CSS for `page` and a deferred link to the full bundle."""
+    if not css_build:
+        return ()
+    return (
+        Style(css_build['critical'].get(page, '')),
+        Link(rel="stylesheet", href=css_build['bundle'], media="print", onload="this.media='all'"),
+    )
+
+
+def layout(*content, site, title=None, htmx=None, show_effects=True, page=None):
+    page_title = f"{title}" if title else site.title
 
     if htmx and htmx.request:
         return (Title(page_title), *content)
@@ -237,10 +364,11 @@ def layout(*content, title=None, htmx=None, show_effects=True):
 
     return (
         Title(page_title),
+        *page_css(page),
         Body(cls="min-h-screen flex flex-col")(
             canvas,
             Div(cls="flex flex-col min-h-screen")(
-                navbar(),
+                navbar(site),
                 Div(main, cls="content-overlay flex-1"),
                 Footer(
                     Div(
@@ -260,8 +388,10 @@ def layout(*content, title=None, htmx=None, show_effects=True):
 # ============================================
 
 @rt('/')
-def index(htmx=None):
+@LISTING
+def index(req, htmx=None):
     """Home page with visual effects and social links."""
+    site = req.scope['site']
 
     hero = Div(
         effect_controls(),
@@ -269,7 +399,7 @@ def index(htmx=None):
     )
 
     intro = Div(
-        H1("Robbie Preswick", cls="text-3xl md:text-4xl font-bold mb-2 glow-text-subtle"),
+        H1(site.title, cls="text-3xl md:text-4xl font-bold mb-2 glow-text-subtle"),
         Div(
             *[A(
                 Span(s['name']),
@@ -277,15 +407,15 @@ def index(htmx=None):
                 target="_blank",
                 rel="noopener noreferrer",
                 cls="text-muted text-sm hover:text-accent-primary transition-all"
-            ) for s in SOCIALS],
+            ) for s in site.socials],
             cls="flex gap-8 mb-4"
         ),
-        P("Builder of things.", cls="text-secondary text-lg"),
+        P(site.tagline, cls="text-secondary text-lg") if site.tagline else None,
         cls="py-8"
     )
 
     # Recent posts
-    posts = get_posts(3)
+    posts = site.posts.posts(3)
     post_items = []
     for p in posts:
         post_items.append(
@@ -317,22 +447,28 @@ def index(htmx=None):
         hero,
         intro,
         blog_section,
+        site=site,
         title="Home",
-        htmx=htmx
+        htmx=htmx,
+        page="index"
     )
 
 
 @rt('/blog')
-def blog(htmx=None):
+@LISTING
+def blog(req, htmx=None):
     """Blog listing page."""
-    posts = get_posts()
+    site = req.scope['site']
+    posts = site.posts.posts()
 
     if not posts:
         return layout(
             H1("Blog", cls="text-2xl font-bold mb-8"),
             P("No blog posts yet. Check back soon!", cls="text-muted"),
+            site=site,
             title="Blog",
-            htmx=htmx
+            htmx=htmx,
+            page="blog"
         )
 
     post_cards = []
@@ -364,26 +500,74 @@ def blog(htmx=None):
     return layout(
         H1("Blog", cls="text-2xl font-bold mb-8"),
         Div(*post_cards, cls="grid gap-4"),
+        site=site,
         title="Blog",
-        htmx=htmx
+        htmx=htmx,
+        page="blog"
+    )
+
+
+def not_found_page(site, htmx=None):
+    return layout(
+        H2("404 - Post Not Found", cls="text-accent-error text-2xl mb-4"),
+        P("The requested post could not be found.", cls="text-muted mb-4"),
+        hx_link("\u2190 Back to blog", "/blog", cls="text-accent-link"),
+        site=site,
+        title="Not Found",
+        htmx=htmx,
+        page="not-found"
     )
 
 
+def not_found(req, htmx=None):
+    """The 404 page, rendered once per site and kept as HTML."""
+    site = req.scope['site']
+    partial = bool(htmx and htmx.request)
+    key = ('not-found', partial)
+    html = site.pages.get(key)
+    if html is None:
+        start = time.perf_counter()
+        page = not_found_page(site, htmx)
+        if partial:
+            html = to_xml(page)
+        else:
+            title, *heads, body = page
+            html = to_xml(respond(req, [title, *heads], [body]))
+        site.pages.put(key, html, cost=time.perf_counter() - start)
+    # htmx only swaps 2xx responses, so in-page navigation keeps a 200; the
+    # same Vary FastHTML puts on every page keeps caches from mixing the two
+    return HTMLResponse(
+        html,
+        status_code=200 if partial else 404,
+        headers={'Vary': 'HX-Request, HX-History-Restore-Request'},
+    )
+
+
+def known_slugs_only(f):
+    """Answer unknown slugs with the pre-rendered 404 before admission control."""
+
+    @wraps(f)
+    async def wrapper(**kwargs):
+        req = kwargs['req']
+        # Both may rescan the posts directory or render the 404; keep that off the event loop
+        if not await run_in_threadpool(req.scope['site'].has_post, kwargs['slug']):
+            return await run_in_threadpool(not_found, req, kwargs.get('htmx'))
+        return await f(**kwargs)
+
+    return wrapper
+
+
 @rt('/blog/{slug}')
-def blogpost(slug: str, htmx=None):
+@known_slugs_only
+@RENDER
+def blogpost(slug: str, req, htmx=None):
     """Individual blog post page."""
-    post_path = Path('posts') / f'{slug}.md'
-
-    if not post_path.exists():
-        return layout(
-            H2("404 - Post Not Found", cls="text-accent-error text-2xl mb-4"),
-            P("The requested post could not be found.", cls="text-muted mb-4"),
-            hx_link("\u2190 Back to blog", "/blog", cls="text-accent-link"),
-            title="Not Found",
-            htmx=htmx
-        )
+    site = req.scope['site']
+    p = site.posts.get(slug)
 
-    p = Post(post_path)
+    # Removed since has_post() said it exists
+    if p is None:
+        return not_found_page(site, htmx)
 
     tags = Div(
         *[Span(tag, cls="tag tag-primary") for tag in p.tags],
@@ -399,10 +583,11 @@ def blogpost(slug: str, htmx=None):
         )
     )
 
-    content = render_md(p.content)
+    content = render_post(site, p)
 
     footer = Div(
         Hr(cls="divider my-8"),
+        related_posts(site, slug),
         hx_link("\u2190 Back to blog", "/blog", cls="text-accent-link"),
     )
 
@@ -413,11 +598,161 @@ def blogpost(slug: str, htmx=None):
             footer,
             cls="max-w-2xl"
         ),
+        site=site,
         title=p.title,
-        htmx=htmx
+        htmx=htmx,
+        page="post"
     )
 
 
+@rt('/blog/{slug}/assets/{digest}/{name:path}')
+def post_asset(slug: str, digest: str, name: str, req):
+    """A file from posts/<slug>/, served immutable under its content hash."""
+    site = req.scope['site']
+    asset = site.assets.get(slug, name)
+    if asset is None:
+        return Response("Not Found", status_code=404, media_type="text/plain")
+    path, current = asset
+    # Old hash from a stale page or feed: send them to the current file
+    if digest != current:
+        return RedirectResponse(asset_url(slug, current, name), status_code=302)
+    return AssetResponse(path, headers={'Cache-Control': IMMUTABLE})
+
+
+# ============================================
+# JSON API
+# ============================================
+
+def api_response(req, key, build):
+    """
+    JSON response for the current site's posts, revalidated by ETag.
+
+    `key` identifies the query; together with the post index version it
+    determines the body, so a matching If-None-Match is answered with 304
+    before anything is serialized.
+    """
+    site = req.scope['site']
+    site.posts.refresh()
+    tag = etag(site.name, site.posts.version, *key)
+    headers = {'ETag': tag, 'Cache-Control': 'no-cache'}
+    if etag_matches(tag, req.headers.get('if-none-match')):
+        return Response(status_code=304, headers=headers)
+
+    body = site.api_cache.get(tag)
+    if body is None:
+        start = time.perf_counter()
+        result = build(site)
+        if isinstance(result, Response):
+            return result
+        body = dumps(result)
+        site.api_cache.put(tag, body, cost=time.perf_counter() - start)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def api_error(message, status_code=400):
+    return Response(dumps({'error': message}), status_code=status_code, media_type="application/json")
+
+
+@rt('/api/posts')
+def api_posts(req, page: int = 1, per_page: int = 20, tag: str = None,
+              since: str = None, until: str = None, fields: str = None):
+    """Paginated post metadata, filterable by tag and date range."""
+    try:
+        names = parse_fields(fields, LIST_FIELDS)
+        since, until = parse_date(since, 'since'), parse_date(until, 'until')
+    except ApiError as e:
+        return api_error(str(e))
+    page = max(page, 1)
+    per_page = min(max(per_page, 1), MAX_PER_PAGE)
+
+    def build(site):
+        posts = filter_posts(site.posts.posts(), tag, since, until)
+        start = (page - 1) * per_page
+        return {
+            'posts': [post_fields(p, names) for p in posts[start:start + per_page]],
+            'page': page,
+            'per_page': per_page,
+            'total': len(posts),
+            'pages': -(-len(posts) // per_page),
+        }
+
+    return api_response(req, ('list', page, per_page, tag, since, until, names), build)
+
+
+@rt('/api/posts/{slug}')
+def api_post(slug: str, req, fields: str = None):
+    """A single post, body included unless projected away."""
+    try:
+        names = parse_fields(fields, ALL_FIELDS)
+    except ApiError as e:
+        return api_error(str(e))
+    # Answer a missing post before the ETag check, so If-None-Match: * can't 304 it
+    if req.scope['site'].posts.get(slug) is None:
+        return api_error("post not found", status_code=404)
+
+    def build(site):
+        p = site.posts.get(slug)
+        if p is None:
+            return api_error("post not found", status_code=404)
+        return post_fields(p, names)
+
+    return api_response(req, ('post', slug, names), build)
+
+
+# ============================================
+# Status
+# ============================================
+
+# Status pages expose hosts and cache internals. They answer direct local
+# requests, or anyone presenting STATUS_TOKEN in X-Status-Token; requests
+# relayed by a local reverse proxy need the token too.
+STATUS_TOKEN = os.environ.get('STATUS_TOKEN', '')
+
+
+def status_allowed(req):
+    token = req.headers.get('x-status-token', '')
+    if STATUS_TOKEN and hmac.compare_digest(token, STATUS_TOKEN):
+        return True
+    if 'x-forwarded-for' in req.headers or 'forwarded' in req.headers:
+        return False
+    try:
+        return ipaddress.ip_address(req.client.host).is_loopback
+    except (AttributeError, ValueError):
+        return False
+
+
+def guard_status(req):
+    if req.url.path.startswith('/_status/') and not status_allowed(req):
+        return Response("Not Found", status_code=404, media_type="text/plain")
+
+
+app.before.append(Beforeware(guard_status))
+
+
+@rt('/_status/admission')
+def admission_status():
+    """Queue depth and shed counts for each route class."""
+    return {rc.name: rc.stats() for rc in ROUTE_CLASSES}
+
+
+@rt('/_status/render')
+def render_status():
+    """Render pool dedupe and timeout counters."""
+    return RENDERER.stats()
+
+
+@rt('/_status/sites')
+def sites_status():
+    """Requests, post counts and render cache usage for each site."""
+    return {site.name: site.stats() for site in SITES}
+
+
+@rt('/_status/memory')
+def memory_status():
+    """Budget use, pinned post memory, and occupancy, hit rate and evictions per cache."""
+    return MEMORY.stats()
+
+
 # ============================================
 # Run
 # ============================================
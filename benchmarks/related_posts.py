@@ -0,0 +1,58 @@
+"""
+Benchmark the related-posts index on a synthetic archive.
+
+Usage:
+    python -m benchmarks.related_posts [n_posts]
+"""
+
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+from services import RelatedIndex
+
+VOCAB = [f"term{i}" for i in range(20000)]
+TAGS = [f"tag{i}" for i in range(200)]
+
+
+def synthetic_post(i, rng):
+    # Posts cluster around topics so neighbour lists are meaningful
+    topic = i % 100
+    words = VOCAB[topic * 150:topic * 150 + 600]
+    return SimpleNamespace(
+        slug=f"post-{i}",
+        title=" ".join(rng.choices(words, k=6)),
+        content=" ".join(rng.choices(words, k=rng.randint(300, 1200))),
+        tags=rng.sample(TAGS[topic:topic + 10], 3),
+    )
+
+
+def main(n=10_000):
+    rng = random.Random(0)
+    posts = [synthetic_post(i, rng) for i in range(n)]
+
+    index = RelatedIndex(k=5)
+    start = time.perf_counter()
+    index.build(posts)
+    print(f"build      {n:>6} posts  {time.perf_counter() - start:8.2f}s")
+
+    for changes in (1, 10):
+        edited = list(posts)
+        for i in rng.sample(range(n), changes):
+            edited[i] = synthetic_post(i, random.Random(rng.random()))
+        start = time.perf_counter()
+        index.update(edited)
+        print(f"update     {changes:>6} posts  {time.perf_counter() - start:8.2f}s")
+        posts = edited
+
+    slugs = [p.slug for p in posts]
+    start = time.perf_counter()
+    for slug in slugs:
+        index.related(slug)
+    per_lookup = (time.perf_counter() - start) / len(slugs)
+    print(f"lookup     {'':>6}        {per_lookup * 1e6:8.2f}us")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
@@ -0,0 +1,153 @@
+"""
+Build step: prune unused CSS and extract per-route critical CSS.
+
+Renders every route class through the real page handlers, collects the
+classes, ids and tags they emit, and writes
+
+    static/css/build/site.<hash>.css   pruned bundle, loaded deferred
+    static/css/build/manifest.json     bundle URL + critical CSS per route
+
+The app inlines the critical CSS for each route and defers the bundle when
+the manifest is present and newer than the stylesheets, app.py, components/
+and static/js/ it was built from.
+
+Usage:
+    python build_css.py
+"""
+
+import hashlib
+import inspect
+import json
+from pathlib import Path
+
+from fasthtml.common import Request, to_xml
+
+import app
+from components import theme_script
+from services.css import Usage, collect_usage, parse_css, prune, script_classes, serialize
+from services.render_pool import render_markdown
+
+CSS_DIR = Path('static/css')
+BUILD_DIR = CSS_DIR / 'build'
+
+# Classes added by libraries rather than by our components
+SAFELIST = {'htmx-request', 'htmx-added', 'htmx-settling', 'htmx-swapping', 'htmx-indicator'}
+
+# Every construct the markdown renderer supports, so post pages keep styling
+# for elements no post on disk happens to use yet (e.g. h5 headings)
+MARKDOWN_SAMPLE = """
+# h1
+## h2
+### h3
+#### h4
+##### h5
+###### h6
+
+*em* **strong** ~~del~~ `code` [link](/) ![img](x.png)<br>
+
+> quote
+
+- item
+- [ ] task
+
+1. item
+
+---
+
+```python
+code
+```
+
+| a | b |
+|---|---|
+| 1 | 2 |
+
+note[^1]
+
+[^1]: footnote
+"""
+
+# Inline HTML posts may use that the sample above does not produce
+MARKDOWN_TAGS = {'dl', 'dt', 'dd', 'kbd', 'sub', 'sup', 'figure', 'figcaption', 'details', 'summary', 'span', 'div'}
+
+
+def site_request(site):
+    req = Request({'type': 'http', 'method': 'GET', 'path': '/', 'headers': [], 'query_string': b''})
+    req.scope['site'] = site
+    return req
+
+
+def route_pages():
+    """Rendered HTML for every page of every site, grouped by route class."""
+    # Unwrap past the route registration and admission control decorators
+    index, blog, blogpost = map(inspect.unwrap, (app.index, app.blog, app.blogpost))
+    pages = {'index': [], 'blog': [], 'post': [], 'not-found': []}
+    # Real post HTML rather than the fallback shown while workers boot
+    app.RENDERER.start(wait=True)
+    for site in app.SITES:
+        req = site_request(site)
+        # Post pages should include their related-posts section
+        site.posts.refresh()
+        site.posts.settle()
+        pages['index'].append(to_xml(index(req)))
+        pages['blog'].append(to_xml(blog(req)))
+        pages['post'].extend(to_xml(blogpost(p.slug, req)) for p in site.posts.posts())
+        pages['not-found'].append(to_xml(app.not_found_page(site)))
+    return pages
+
+
+def main():
+    sources = [CSS_DIR / f for f in app.CSS_SOURCES]
+    nodes = [node for src in sources for node in parse_css(src.read_text())]
+    full_bytes = sum(src.stat().st_size for src in sources)
+
+    runtime = Usage(
+        classes=SAFELIST | script_classes(
+            *(p.read_text() for p in Path('static/js').glob('*.js')),
+            to_xml(theme_script()),
+        )
+    )
+
+    site = Usage().update(runtime)
+    critical, used_bytes = {}, {}
+    for route, pages in route_pages().items():
+        route_all = Usage().update(runtime)
+        if route == 'post':
+            route_all.update(collect_usage(render_markdown(MARKDOWN_SAMPLE))[0])
+            route_all.update(Usage(tags=MARKDOWN_TAGS))
+        route_critical = Usage().update(runtime)
+        for html in pages:
+            seen, above_fold = collect_usage(html)
+            route_all.update(seen)
+            route_critical.update(above_fold)
+        site.update(route_all)
+        critical[route] = serialize(prune(nodes, route_critical))
+        used_bytes[route] = len(serialize(prune(nodes, route_all)).encode())
+
+    bundle = serialize(prune(nodes, site))
+    digest = hashlib.sha256(bundle.encode()).hexdigest()[:10]
+
+    BUILD_DIR.mkdir(exist_ok=True)
+    for old in BUILD_DIR.glob('site.*.css'):
+        old.unlink()
+    bundle_path = BUILD_DIR / f'site.{digest}.css'
+    bundle_path.write_text(bundle)
+    (BUILD_DIR / 'manifest.json').write_text(json.dumps({
+        'bundle': f'/{bundle_path.as_posix()}',
+        'critical': critical,
+    }, indent=2))
+
+    # before: CSS every page used to block on; used: rules the route can match;
+    # inline: critical CSS now blocking render; saved: blocking bytes removed
+    bundle_bytes = len(bundle.encode())
+    print(f"{'route':<12}{'before':>9}{'used':>9}{'inline':>9}{'deferred':>10}{'saved':>9}")
+    for route, css in critical.items():
+        inline_bytes = len(css.encode())
+        print(f"{route:<12}{full_bytes:>9}{used_bytes[route]:>9}{inline_bytes:>9}"
+              f"{bundle_bytes:>10}{full_bytes - inline_bytes:>9}")
+    print(f"\nwrote {bundle_path} and {BUILD_DIR / 'manifest.json'}")
+    app.RENDERER.shutdown()
+
+
+if __name__ == "__main__":
+    main()
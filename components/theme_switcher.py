@@ -12,18 +12,20 @@ THEMES = [
 def theme_script():
     """
     JavaScript for theme switching with localStorage persistence.
-    Should be included in the page head.
+    Should be included in the page head. The default theme comes from a
+    `data-default-theme` attribute on <html>, falling back to cyberpunk.
     """
     return Script("""
         // Theme management
         const THEMES = ['cyberpunk', 'darcula', 'nordic', 'light'];
+        const DEFAULT_THEME = document.documentElement.dataset.defaultTheme || 'cyberpunk';
 
         function getStoredTheme() {
-            return localStorage.getItem('ftui-theme') || 'cyberpunk';
+            return localStorage.getItem('ftui-theme') || DEFAULT_THEME;
         }
 
         function setTheme(theme) {
-            if (!THEMES.includes(theme)) theme = 'cyberpunk';
+            if (!THEMES.includes(theme)) theme = DEFAULT_THEME;
 
             // Update data attribute
             document.documentElement.setAttribute('data-theme', theme);
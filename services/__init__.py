@@ -0,0 +1,19 @@
+"""Runtime services for the site: sites, posts, rendering and caching"""
+
+from .admission import RouteClass
+from .assets import AssetIndex, AssetResponse
+from .cache import Cache, MemoryBudget, sizeof
+from .posts import Post, PostIndex
+from .related import RelatedIndex
+from .render_pool import RenderPool
+from .sites import Site, SiteRouter
+
+__all__ = [
+    'RouteClass',
+    'AssetIndex', 'AssetResponse',
+    'Cache', 'MemoryBudget', 'sizeof',
+    'Post', 'PostIndex',
+    'RelatedIndex',
+    'RenderPool',
+    'Site', 'SiteRouter',
+]
@@ -0,0 +1,149 @@
+"""Admission Control and Load Shedding for Render-Heavy Routes"""
+
+import asyncio
+import sys
+import time
+from functools import wraps
+
+from fasthtml.common import FtResponse, HTMLResponse, Request, Response
+from starlette.concurrency import run_in_threadpool
+
+from .cache import sizeof
+
+
+class RouteClass:
+    """
+    Bounded concurrency limiter shared by a class of routes.
+
+    Handlers beyond `limit` wait in a short queue; once the queue is full,
+    or a queued request waits longer than `timeout`, the request is shed.
+    A shed request gets the last good page for the same arguments when one
+    is cached, otherwise a fast 503 with `Retry-After`. Pages are rendered
+    to HTML in the worker thread and cached as HTML, so neither rendering
+    nor measuring them ever runs on the event loop.
+
+    Args:
+        name: Route class name (used in stats)
+        limit: Maximum handlers running at once
+        queue: Maximum requests waiting for a slot
+        timeout: Seconds a queued request waits before being shed
+        retry_after: Seconds advertised in the Retry-After header
+        stale: `Cache` of recent good pages' HTML for stale serving;
+            without one, shed requests always get a 503
+    """
+
+    def __init__(self, name, limit=8, queue=16, timeout=2.0, retry_after=5, stale=None):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._slots = None
+        self._stale = stale
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.shed = 0
+        self.stale_served = 0
+
+    async def acquire(self):
+        """Wait for a slot. Returns False if the request should be shed."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.limit)
+        if self._slots.locked():
+            if self.queued >= self.queue:
+                self.shed += 1
+                return False
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                self.shed += 1
+                return False
+            finally:
+                self.queued -= 1
+        else:
+            await self._slots.acquire()
+        self.active += 1
+        self.admitted += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+        self._slots.release()
+
+    def remember(self, key, html, cost):
+        # A flat string's size is known without walking it; the cache drops
+        # it unmeasured if it can never fit
+        self._stale.put(key, html, cost, size=sizeof(key) + sys.getsizeof(html))
+
+    def overloaded(self, key):
+        """Response for a shed request: a stale copy if we have one, else 503."""
+        html = self._stale.get(key) if self._stale is not None else None
+        if html is not None:
+            self.stale_served += 1
+            return HTMLResponse(html, headers={'Vary': 'HX-Request, HX-History-Restore-Request'})
+        return Response(
+            "Service temporarily overloaded, please retry.",
+            status_code=503,
+            headers={'Retry-After': str(self.retry_after)},
+            media_type="text/plain",
+        )
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'active': self.active,
+            'queue_depth': self.queued,
+            'queue_limit': self.queue,
+            'admitted': self.admitted,
+            'shed': self.shed,
+            'stale_served': self.stale_served,
+        }
+
+    def __call__(self, f):
+        """Decorate a route handler so it runs under this limiter."""
+
+        @wraps(f)
+        async def wrapper(*args, **kwargs):
+            key = _stale_key(f, args, kwargs)
+            if not await self.acquire():
+                return self.overloaded(key)
+            try:
+                return await run_in_threadpool(self._handle, f, key, args, kwargs)
+            finally:
+                self.release()
+
+        return wrapper
+
+    def _handle(self, f, key, args, kwargs):
+        """Run the handler and keep its page as stale HTML (in a worker thread)."""
+        start = time.perf_counter()
+        resp = f(*args, **kwargs)
+        req = next((v for v in kwargs.values() if isinstance(v, Request)), None)
+        if self._stale is None or req is None:
+            return resp
+        # Render the way FastHTML would, here rather than on the event loop
+        if not isinstance(resp, Response):
+            resp = FtResponse(resp).__response__(req)
+        if resp.status_code == 200 and isinstance(resp, HTMLResponse):
+            self.remember(key, resp.body.decode(), time.perf_counter() - start)
+        return resp
+
+
+def _stale_key(f, args, kwargs):
+    """
+    Cache key for a call to handler `f`. Handlers sharing a route class
+    are kept apart, as are htmx fragments and full pages; requests are
+    keyed by the site they resolved to, so host spellings and unknown
+    hosts share that site's copy.
+    """
+    items = []
+    for k, v in sorted(kwargs.items()):
+        if k == 'htmx':
+            v = bool(v and v.request)
+        elif isinstance(v, Request):
+            site = v.scope.get('site')
+            v = site.name if site is not None else v.headers.get('host')
+        items.append((k, v))
+    return (f.__qualname__, args, tuple(items))
@@ -0,0 +1,80 @@
+"""Read-Only JSON API Helpers"""
+
+import hashlib
+from datetime import date
+from operator import attrgetter
+
+import orjson
+
+LIST_FIELDS = ('slug', 'title', 'date', 'excerpt', 'tags', 'url')
+ALL_FIELDS = LIST_FIELDS + ('body',)
+
+MAX_PER_PAGE = 100
+
+
+class ApiError(ValueError):
+    """A bad query parameter; the message is returned to the caller."""
+
+
+def parse_fields(fields, default):
+    """Validate a comma-separated `fields=` projection."""
+    if not fields:
+        return default
+    names = tuple(f.strip() for f in fields.split(',') if f.strip())
+    unknown = [f for f in names if f not in FIELD_GETTERS]
+    if unknown:
+        raise ApiError(f"unknown fields: {', '.join(unknown)}")
+    return names
+
+
+def parse_date(value, name):
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ApiError(f"{name} must be an ISO date (YYYY-MM-DD)") from None
+
+
+FIELD_GETTERS = {
+    'slug': attrgetter('slug'),
+    'title': attrgetter('title'),
+    'date': attrgetter('datestr'),
+    'excerpt': attrgetter('excerpt'),
+    'tags': lambda p: [str(t) for t in p.tags],
+    'url': lambda p: f"/blog/{p.slug}",
+    'body': attrgetter('content'),
+}
+
+
+def post_fields(post, fields):
+    """Project a post onto `fields`, in the order requested."""
+    return {f: FIELD_GETTERS[f](post) for f in fields}
+
+
+def filter_posts(posts, tag=None, since=None, until=None):
+    """Posts with `tag`, dated within [since, until] (ISO date strings)."""
+    return [
+        p for p in posts
+        if (tag is None or tag in (str(t) for t in p.tags))
+        and (since is None or p.datestr >= since)
+        and (until is None or p.datestr <= until)
+    ]
+
+
+def etag(*parts):
+    """Strong ETag over the parts that determine a response body."""
+    digest = hashlib.blake2b('|'.join(map(str, parts)).encode(), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(tag, if_none_match):
+    """True if an If-None-Match header value covers `tag`."""
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(',')]
+    return '*' in candidates or tag in (c.removeprefix('W/') for c in candidates)
+
+
+def dumps(obj):
+    return orjson.dumps(obj)
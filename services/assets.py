@@ -0,0 +1,210 @@
+"""Post-Attached Assets with Content-Hashed URLs"""
+
+import hashlib
+import queue
+import re
+import threading
+import time
+from html import unescape
+from pathlib import Path
+from urllib.parse import quote, unquote
+
+from starlette.responses import FileResponse
+
+ASSET_ATTR_RE = re.compile(r'(\b(?:src|href)=")([^"]*)(")')
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def asset_url(slug, digest, name):
+    return f"/blog/{quote(slug)}/assets/{digest}/{quote(name)}"
+
+
+def rewrite_asset_urls(html, urls):
+    """Point `src`/`href` attributes that name a post asset at its hashed URL."""
+    # Attribute values arrive entity- and percent-encoded (`my%20pic.png`)
+    return ASSET_ATTR_RE.sub(lambda m: f"{m[1]}{urls.get(unquote(unescape(m[2])), m[2])}{m[3]}", html)
+
+
+class AssetIndex:
+    """
+    Files in `posts/<slug>/` directories and their content hashes.
+
+    Only directories belonging to a post (per `is_post`) are indexed, so
+    drafts and other stray directories are never served. Each post's
+    directory is scanned on first use and rescanned at most every `refresh`
+    seconds, and only when that post is asked about.
+
+    Hashing never happens on a request thread: a new or changed file is
+    addressed by a digest of its name, size and mtime until a background
+    thread has hashed its contents, then by its content hash. Both change
+    whenever the file does, so either is safe to serve as immutable; the
+    asset route redirects from a superseded digest to the current one.
+
+    Args:
+        posts_dir: Directory of markdown posts
+        is_post: Callable telling whether a slug names a post
+        refresh: Minimum seconds between scans of one post's directory
+    """
+
+    def __init__(self, posts_dir, is_post=lambda slug: True, refresh=5.0):
+        self.posts_dir = Path(posts_dir)
+        self.is_post = is_post
+        self.refresh_interval = refresh
+        self._files = {}
+        self._urls = {}
+        self._versions = {}
+        self._checked = {}
+        self._lock = threading.Lock()
+        self._pending = queue.SimpleQueue()
+        self._hasher = None
+        self.hashing = 0
+
+    def get(self, slug, name):
+        """`(path, digest)` for an asset, or None if `slug` has no such file."""
+        self.refresh(slug)
+        entry = self._files.get(slug, {}).get(name)
+        return (entry[0], entry[2]) if entry else None
+
+    def urls(self, slug):
+        """Map of every way a post may reference an asset to its hashed URL."""
+        self.refresh(slug)
+        return self._urls.get(slug, {})
+
+    def version(self, slug):
+        """Changes whenever any of the post's assets do; empty if it has none."""
+        self.refresh(slug)
+        return self._versions.get(slug, '')
+
+    def stats(self):
+        return {
+            'posts': len(self._files),
+            'files': sum(len(f) for f in self._files.values()),
+            'bytes': sum(e[1][1] for f in self._files.values() for e in f.values()),
+            'hashing': self.hashing,
+        }
+
+    def refresh(self, slug, force=False):
+        """Rescan `slug`'s directory if it is due (or `force`)."""
+        if not self.is_post(slug):
+            # Unknown slugs (probes, deleted posts) leave nothing behind
+            if slug in self._checked:
+                with self._lock:
+                    self._checked.pop(slug, None)
+                    self._publish(slug, {})
+            return
+        now = time.monotonic()
+        if not force and now - self._checked.get(slug, float('-inf')) < self.refresh_interval:
+            return
+        with self._lock:
+            self._checked[slug] = now
+            old = self._files.get(slug, {})
+            entries = self._scan(slug, old)
+            if entries != old:
+                self._publish(slug, entries)
+
+    def _scan(self, slug, old):
+        d = self.posts_dir / slug
+        if not d.is_dir():
+            return {}
+        entries = {}
+        for path in sorted(d.rglob('*')):
+            rel = path.relative_to(d).as_posix()
+            if not path.is_file() or any(part.startswith('.') for part in rel.split('/')):
+                continue
+            st = path.stat()
+            stamp = (st.st_mtime_ns, st.st_size)
+            prev = old.get(rel)
+            if prev and prev[1] == stamp:
+                entries[rel] = prev
+            else:
+                entries[rel] = (path, stamp, _stamp_digest(rel, stamp))
+                self._hash_later(slug, rel, path, stamp)
+        return entries
+
+    def _publish(self, slug, entries):
+        """Swap in `slug`'s files, URLs and version; called with the lock held."""
+        if not entries:
+            self._files.pop(slug, None)
+            self._urls.pop(slug, None)
+            self._versions.pop(slug, None)
+            return
+        spellings = {}
+        for rel, (_, _, digest) in entries.items():
+            url = asset_url(slug, digest, rel)
+            for name in (rel, f"./{rel}", f"{slug}/{rel}", f"./{slug}/{rel}"):
+                spellings[name] = url
+        self._files[slug] = entries
+        self._urls[slug] = spellings
+        self._versions[slug] = hashlib.blake2b(
+            ''.join(e[2] for e in entries.values()).encode(), digest_size=8
+        ).hexdigest()
+
+    def _hash_later(self, slug, rel, path, stamp):
+        self.hashing += 1
+        self._pending.put((slug, rel, path, stamp))
+        if self._hasher is None:
+            self._hasher = threading.Thread(target=self._hash_files, name='asset-hasher', daemon=True)
+            self._hasher.start()
+
+    def _hash_files(self):
+        while True:
+            slug, rel, path, stamp = self._pending.get()
+            try:
+                digest = _file_digest(path)
+            except OSError:
+                digest = None  # gone or unreadable; the next scan sorts it out
+            with self._lock:
+                self.hashing -= 1
+                entries = self._files.get(slug, {})
+                # Only if the file is still the one that was hashed
+                if digest and rel in entries and entries[rel][1] == stamp:
+                    self._publish(slug, {**entries, rel: (path, stamp, digest)})
+
+
+def _stamp_digest(rel, stamp):
+    return hashlib.blake2b(f"{rel}:{stamp[0]}:{stamp[1]}".encode(), digest_size=8).hexdigest()
+
+
+def _file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=8)).hexdigest()
+
+
+class AssetResponse(FileResponse):
+    """
+    FileResponse that uses the server's zero-copy sendfile when offered.
+
+    Starlette already streams files in chunks, honours Range requests and
+    uses `http.response.pathsend` for whole files; this adds the ASGI
+    `http.response.zerocopysend` extension so byte ranges can be handed to
+    sendfile too.
+    """
+
+    async def __call__(self, scope, receive, send):
+        self._zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+        await super().__call__(scope, receive, send)
+
+    async def _handle_simple(self, send, send_header_only, send_pathsend):
+        if send_header_only or send_pathsend or not self._zerocopy:
+            return await super()._handle_simple(send, send_header_only, send_pathsend)
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        await self._sendfile(send, 0, int(self.headers["content-length"]))
+
+    async def _handle_single_range(self, send, start, end, file_size, send_header_only):
+        if send_header_only or not self._zerocopy:
+            return await super()._handle_single_range(send, start, end, file_size, send_header_only)
+        self.headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+        self.headers["content-length"] = str(end - start)
+        await send({"type": "http.response.start", "status": 206, "headers": self.raw_headers})
+        await self._sendfile(send, start, end - start)
+
+    async def _sendfile(self, send, offset, count):
+        with open(self.path, 'rb') as f:
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": f,
+                "offset": offset,
+                "count": count,
+                "more_body": False,
+            })
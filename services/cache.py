@@ -0,0 +1,241 @@
+"""Shared Memory Budget and Cost-Aware Caches"""
+
+import heapq
+import sys
+import threading
+from itertools import count
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+
+# Shared objects a cached value may point at but does not own
+_OPAQUE = (type, ModuleType, FunctionType, BuiltinFunctionType, MethodType)
+
+
+def sizeof(obj):
+    """
+    Measured memory footprint of `obj` and everything it references.
+
+    Follows containers, instance dicts and `__slots__`, counting each object
+    once; classes, modules and functions are shared and not counted.
+    """
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, _OPAQUE):
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, (str, bytes, bytearray, int, float, bool)) or o is None:
+            continue
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        if hasattr(o, '__dict__'):
+            stack.append(vars(o))
+        for name in getattr(type(o), '__slots__', ()):
+            if hasattr(o, name):
+                stack.append(getattr(o, name))
+    return total
+
+
+class MemoryBudget:
+    """
+    One byte budget shared by every cache in the process.
+
+    Caches evict on their own cap first; when the caches together exceed
+    what the budget leaves after pinned memory (data that must stay
+    resident, like post indexes), the entry with the lowest
+    GreedyDual-Size-Frequency priority among eligible caches is evicted:
+
+        priority = clock + hits * cost / size
+
+    so small, frequently used, expensive-to-rebuild entries survive and
+    large, cold, cheap ones go first. `clock` rises to each evicted
+    priority, which ages entries that stop being used.
+
+    Caches can belong to a group (e.g. one site) with reserved bytes:
+    global pressure never takes a group below its reservation, so a busy
+    group cannot flush a quiet one. Reservations must fit in the budget.
+
+    Args:
+        max_bytes: Total bytes for cached and pinned data
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.caches = []
+        self.lock = threading.RLock()
+        self.clock = 0.0
+        self._pinned = {}
+        self._reserved = {}
+
+    @property
+    def used(self):
+        return sum(c.bytes for c in self.caches)
+
+    @property
+    def pinned(self):
+        return sum(fn() for fn in self._pinned.values())
+
+    def pin(self, name, measure):
+        """Count memory reported by `measure()` against the budget."""
+        self._pinned[name] = measure
+
+    def reserve(self, group, nbytes):
+        """Keep at least `nbytes` of `group`'s cached entries safe from global eviction."""
+        with self.lock:
+            total = sum(self._reserved.values()) - self._reserved.get(group, 0) + nbytes
+            if total > self.max_bytes:
+                raise ValueError(f"reservations of {total} bytes exceed the {self.max_bytes} byte budget")
+            self._reserved[group] = nbytes
+
+    def register(self, cache):
+        with self.lock:
+            self.caches.append(cache)
+
+    def enforce(self):
+        """Evict globally until cached bytes fit alongside pinned memory."""
+        limit = self.max_bytes - self.pinned
+        while self.used > limit:
+            groups = self._group_bytes()
+            victims = [
+                c for c in self.caches
+                if len(c) and (c.group is None or groups[c.group] > self._reserved.get(c.group, 0))
+            ]
+            if not victims:
+                break
+            min(victims, key=lambda c: c.lowest_priority()).evict_one()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'max_bytes': self.max_bytes,
+                'used': self.used,
+                'pinned': {name: fn() for name, fn in self._pinned.items()},
+                'groups': {
+                    g: {'bytes': n, 'reserved': self._reserved.get(g, 0)}
+                    for g, n in self._group_bytes().items()
+                },
+                'caches': {c.name: c.stats() for c in self.caches},
+            }
+
+    def _group_bytes(self):
+        groups = dict.fromkeys(self._reserved, 0)
+        for c in self.caches:
+            if c.group is not None:
+                groups[c.group] = groups.get(c.group, 0) + c.bytes
+        return groups
+
+
+class _Entry:
+    __slots__ = ('value', 'size', 'cost', 'hits', 'priority', 'seq')
+
+
+class Cache:
+    """
+    A named cache drawing on a shared `MemoryBudget`.
+
+    Entry sizes are measured with `sizeof` (key included) unless the caller
+    passes one; `cost` is what the entry took to produce, in seconds.
+
+    Args:
+        name: Cache name (used in stats)
+        budget: The shared `MemoryBudget`
+        max_bytes: Optional cap for this cache alone
+        group: Reservation group this cache belongs to (see `MemoryBudget`)
+    """
+
+    def __init__(self, name, budget, max_bytes=None, group=None):
+        self.name = name
+        self.budget = budget
+        self.max_bytes = max_bytes
+        self.group = group
+        self._entries = {}
+        self._heap = []
+        self._seq = count()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        budget.register(self)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self.budget.lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            entry.hits += 1
+            self._prioritize(key, entry)
+            return entry.value
+
+    def put(self, key, value, cost=0.001, size=None):
+        size = size if size is not None else sizeof(key) + sizeof(value)
+        with self.budget.lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old.size
+            # Never let a single oversized entry flush everything else
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            entry = _Entry()
+            entry.value, entry.size, entry.cost, entry.hits = value, size, cost, 1
+            self._entries[key] = entry
+            self.bytes += size
+            self._prioritize(key, entry)
+            while self.max_bytes is not None and self.bytes > self.max_bytes:
+                self.evict_one()
+            self.budget.enforce()
+
+    def lowest_priority(self):
+        self._settle()
+        return self._heap[0][0] if self._heap else float('inf')
+
+    def evict_one(self):
+        self._settle()
+        priority, _, key = heapq.heappop(self._heap)
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+        self.evictions += 1
+        self.budget.clock = max(self.budget.clock, priority)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            'evictions': self.evictions,
+        }
+
+    def _prioritize(self, key, entry):
+        entry.priority = self.budget.clock + entry.hits * entry.cost / max(entry.size, 1)
+        entry.seq = next(self._seq)
+        heapq.heappush(self._heap, (entry.priority, entry.seq, key))
+        # Hits leave superseded heap items behind; rebuild once they dominate
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [(e.priority, e.seq, k) for k, e in self._entries.items()]
+            heapq.heapify(self._heap)
+
+    def _settle(self):
+        """Drop superseded heap items so the top is a live entry."""
+        heap = self._heap
+        while heap:
+            _, seq, key = heap[0]
+            entry = self._entries.get(key)
+            if entry is not None and entry.seq == seq:
+                return
+            heapq.heappop(heap)
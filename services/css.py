@@ -0,0 +1,291 @@
+"""Unused-CSS Pruning and Critical CSS Extraction"""
+
+import re
+from html.parser import HTMLParser
+
+COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+WS_RE = re.compile(r'\s+')
+CLASS_RE = re.compile(r'\.(-?[_a-zA-Z][\w-]*)')
+ID_RE = re.compile(r'#(-?[_a-zA-Z][\w-]*)')
+# Stripped before looking for type selectors: strings, attributes, pseudos, classes, ids
+NON_TYPE_RE = re.compile(r'"[^"]*"|\'[^\']*\'|\[[^\]]*\]|::?-?[\w-]+(?:\([^)]*\))?|[.#]-?[_a-zA-Z][\w-]*')
+TYPE_RE = re.compile(r'[a-zA-Z][\w-]*')
+ANIMATION_RE = re.compile(r'animation(?:-name)?\s*:\s*([^;]+)')
+JS_CLASS_RE = re.compile(r"classList\.(?:add|toggle|remove|replace)\(\s*['\"]([\w-]+)['\"]")
+
+# Elements every page has, whether or not the rendered markup spells them out
+IMPLICIT_TAGS = {'html', 'head', 'body'}
+
+VOID_TAGS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'source', 'track', 'wbr',
+}
+
+
+class Rule:
+    """A style rule: `selectors { body }`."""
+
+    def __init__(self, selectors, body):
+        self.selectors = selectors
+        self.body = body
+
+    def css(self):
+        return f"{','.join(self.selectors)}{{{self.body}}}"
+
+
+class AtRule:
+    """
+    An at-rule such as `@media`, `@keyframes` or `@font-face`.
+
+    `children` holds nested rules for grouping at-rules (`@media`,
+    `@supports`); `body` holds the raw declarations otherwise.
+    """
+
+    def __init__(self, prelude, children=None, body=None):
+        self.prelude = prelude
+        self.children = children
+        self.body = body
+
+    @property
+    def name(self):
+        return self.prelude.split(None, 1)[0][1:].lower()
+
+    def css(self):
+        if self.children is not None:
+            return f"{self.prelude}{{{''.join(c.css() for c in self.children)}}}"
+        if self.body is None:
+            return f"{self.prelude};"
+        return f"{self.prelude}{{{self.body}}}"
+
+
+def parse_css(text):
+    """Parse a stylesheet into a list of `Rule` and `AtRule` nodes."""
+    text = COMMENT_RE.sub('', text)
+    nodes, _ = _parse_block(text, 0)
+    return nodes
+
+
+def _parse_block(text, i):
+    nodes = []
+    n = len(text)
+    while i < n:
+        start = i
+        # Scan the prelude up to the next `{`, `;` or closing `}`
+        while i < n and text[i] not in '{};':
+            if text[i] in '"\'':
+                i = _skip_string(text, i)
+            else:
+                i += 1
+        prelude = _squash(text[start:i])
+        if i >= n:
+            break
+        if text[i] == '}':
+            return nodes, i + 1
+        if text[i] == ';':
+            if prelude.startswith('@'):
+                nodes.append(AtRule(prelude))
+            i += 1
+            continue
+
+        # text[i] == '{'
+        if prelude.startswith('@') and AtRule(prelude).name in ('media', 'supports', 'layer', 'container'):
+            children, i = _parse_block(text, i + 1)
+            nodes.append(AtRule(prelude, children=children))
+            continue
+
+        body_start = i + 1
+        depth = 1
+        i += 1
+        while i < n and depth:
+            if text[i] in '"\'':
+                i = _skip_string(text, i)
+                continue
+            depth += {'{': 1, '}': -1}.get(text[i], 0)
+            i += 1
+        body = text[body_start:i - 1]
+        if prelude.startswith('@'):
+            nodes.append(AtRule(prelude, body=_squash_body(body)))
+        else:
+            nodes.append(Rule(_split_selectors(prelude), _squash_body(body)))
+    return nodes, i
+
+
+def _skip_string(text, i):
+    quote = text[i]
+    i += 1
+    while i < len(text) and text[i] != quote:
+        i += 2 if text[i] == '\\' else 1
+    return i + 1
+
+
+def _squash(s):
+    return WS_RE.sub(' ', s).strip()
+
+
+def _squash_body(body):
+    body = _squash(body)
+    body = re.sub(r'\s*([:;{}])\s*', r'\1', body)
+    return body.rstrip(';')
+
+
+def _split_selectors(prelude):
+    parts, depth, cur = [], 0, ''
+    for ch in prelude:
+        if ch in '([':
+            depth += 1
+        elif ch in ')]':
+            depth -= 1
+        if ch == ',' and depth == 0:
+            parts.append(cur.strip())
+            cur = ''
+        else:
+            cur += ch
+    parts.append(cur.strip())
+    return [p for p in parts if p]
+
+
+# ============================================
+# Usage Collection
+# ============================================
+
+class Usage:
+    """Classes, ids and tags a page (or set of pages) actually emits."""
+
+    def __init__(self, classes=(), ids=(), tags=()):
+        self.classes = set(classes)
+        self.ids = set(ids)
+        self.tags = set(tags) | IMPLICIT_TAGS
+
+    def update(self, other):
+        self.classes |= other.classes
+        self.ids |= other.ids
+        self.tags |= other.tags
+        return self
+
+    def matches(self, selector):
+        """True if every class, id and type in `selector` is in use."""
+        if not set(CLASS_RE.findall(selector)) <= self.classes:
+            return False
+        if not set(ID_RE.findall(selector)) <= self.ids:
+            return False
+        types = {t.lower() for t in TYPE_RE.findall(NON_TYPE_RE.sub(' ', selector))}
+        return types <= self.tags
+
+
+class _UsageParser(HTMLParser):
+    """
+    Collects usage from rendered HTML.
+
+    Everything outside `#main-content` is page chrome and counts as above
+    the fold, as do the first `fold` elements inside it.
+    """
+
+    def __init__(self, fold):
+        super().__init__(convert_charrefs=True)
+        self.fold = fold
+        self.all = Usage()
+        self.critical = Usage()
+        self._stack = []
+        self._main_depth = None
+        self._main_seen = 0
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = (attrs.get('class') or '').split()
+        ids = [attrs['id']] if attrs.get('id') else []
+        seen = Usage(classes, ids, [tag])
+        self.all.update(seen)
+
+        if self._main_depth is not None:
+            self._main_seen += 1
+            if self._main_seen <= self.fold:
+                self.critical.update(seen)
+        else:
+            self.critical.update(seen)
+
+        if tag in VOID_TAGS:
+            return
+        self._stack.append(tag)
+        if 'main-content' in ids and self._main_depth is None:
+            self._main_depth = len(self._stack)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag not in self._stack:
+            return
+        while self._stack:
+            top = self._stack.pop()
+            if self._main_depth is not None and len(self._stack) < self._main_depth:
+                self._main_depth = None
+            if top == tag:
+                break
+
+
+def collect_usage(html, fold=30):
+    """Return `(all, critical)` usage for a rendered page."""
+    parser = _UsageParser(fold)
+    parser.feed(html)
+    parser.close()
+    return parser.all, parser.critical
+
+
+def script_classes(*sources):
+    """Class names that scripts add or toggle at runtime."""
+    return {c for src in sources for c in JS_CLASS_RE.findall(src)}
+
+
+# ============================================
+# Pruning
+# ============================================
+
+def prune(nodes, usage):
+    """Keep only the rules `usage` can match, plus keyframes they animate."""
+    kept = _prune_rules(nodes, usage)
+    animations = set()
+    _collect_animations(kept, animations)
+    return _prune_keyframes(kept, animations)
+
+
+def _prune_rules(nodes, usage):
+    kept = []
+    for node in nodes:
+        if isinstance(node, Rule):
+            selectors = [s for s in node.selectors if usage.matches(s)]
+            if selectors:
+                kept.append(Rule(selectors, node.body))
+        elif node.children is not None:
+            children = _prune_rules(node.children, usage)
+            if children:
+                kept.append(AtRule(node.prelude, children=children))
+        else:
+            kept.append(node)
+    return kept
+
+
+def _collect_animations(nodes, names):
+    for node in nodes:
+        if isinstance(node, Rule):
+            for value in ANIMATION_RE.findall(node.body):
+                names.update(TYPE_RE.findall(value))
+        elif node.children is not None:
+            _collect_animations(node.children, names)
+
+
+def _prune_keyframes(nodes, animations):
+    kept = []
+    for node in nodes:
+        if isinstance(node, AtRule):
+            if node.name.endswith('keyframes') and node.prelude.split()[-1] not in animations:
+                continue
+            if node.children is not None:
+                node = AtRule(node.prelude, children=_prune_keyframes(node.children, animations))
+        kept.append(node)
+    return kept
+
+
+def serialize(nodes):
+    return '\n'.join(n.css() for n in nodes) + '\n'
@@ -0,0 +1,184 @@
+"""Parsed Posts and the Per-Directory Post Index"""
+
+import hashlib
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import frontmatter
+
+from .cache import sizeof
+from .related import RelatedIndex
+
+
+class Post:
+    # Thousands of these stay resident per site; no per-instance __dict__
+    __slots__ = ('path', 'slug', 'mtime', 'content', 'meta', 'title', 'date', 'excerpt', 'tags', 'datestr')
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.slug = self.path.stem
+        self.mtime = self.path.stat().st_mtime_ns
+        post = frontmatter.load(path)
+        self.content = post.content
+        self.meta = post.metadata
+        self.title = self.meta.get('title', 'Untitled')
+        self.date = self.meta.get('date', datetime.now())
+        self.excerpt = self.meta.get('excerpt', '')
+        self.tags = self.meta.get('tags', [])
+        self.datestr = self.date.strftime('%Y-%m-%d')
+
+
+class PostIndex:
+    """
+    Parsed posts for one posts directory, kept in memory.
+
+    The directory is rescanned at most every `refresh` seconds; only files
+    whose mtime changed are re-parsed. The related-posts index is updated
+    from each scan on a background thread, so no request ever waits on a
+    build; until the first build lands, posts simply have no related posts.
+    A file that fails to parse is left out (and listed in `errors`) without
+    affecting the rest of the index.
+
+    `version` changes whenever the set of posts or any post's mtime does,
+    and is the same in every process looking at the same files, so it can
+    key caches and ETags. `bytes` is the measured size of the parsed posts
+    and related index, for memory budgets.
+
+    Args:
+        posts_dir: Directory of markdown posts
+        refresh: Minimum seconds between directory scans
+        related_k: Number of related posts kept per slug
+    """
+
+    def __init__(self, posts_dir, refresh=5.0, related_k=3):
+        self.posts_dir = Path(posts_dir)
+        self.refresh_interval = refresh
+        self.related_index = RelatedIndex(k=related_k)
+        self._posts = {}
+        self._mtimes = {}
+        self._sorted = []
+        self.errors = {}
+        self._sizes = {}
+        self._posts_bytes = 0
+        self._related_bytes = 0
+        self._related_pending = None
+        self._related_thread = None
+        self._related_lock = threading.Lock()
+        self._related_broken = False
+        self.related_failures = 0
+        self.version = ''
+        self._checked = float('-inf')
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        self.refresh()
+        return len(self._posts)
+
+    @property
+    def bytes(self):
+        return self._posts_bytes + self._related_bytes
+
+    def __contains__(self, slug):
+        self.refresh()
+        return slug in self._posts
+
+    def get(self, slug):
+        self.refresh()
+        return self._posts.get(slug)
+
+    def posts(self, n=None):
+        """Posts newest first, optionally only the first `n`."""
+        self.refresh()
+        return self._sorted[:n] if n else self._sorted
+
+    def related(self, slug):
+        """Posts related to `slug`, best first."""
+        self.refresh()
+        return [self._posts[s] for s in self.related_index.related(slug) if s in self._posts]
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked < self.refresh_interval:
+            return
+        # Another thread is already scanning; serve the current index meanwhile,
+        # unless there is nothing to serve yet
+        if not self._lock.acquire(blocking=force or not self._loaded):
+            return
+        try:
+            self._checked = now
+            paths = self.posts_dir.glob('*.md') if self.posts_dir.exists() else []
+            mtimes = {p.stem: p.stat().st_mtime_ns for p in paths}
+            if mtimes == self._mtimes:
+                return
+            posts = dict(self._posts)
+            errors = {s: e for s, e in self.errors.items() if self._mtimes.get(s) == mtimes.get(s)}
+            for slug, mtime in mtimes.items():
+                if self._mtimes.get(slug) != mtime:
+                    try:
+                        posts[slug] = Post(self.posts_dir / f'{slug}.md')
+                    except Exception as e:
+                        # Bad frontmatter, a date that isn't a date, a file gone
+                        # mid-scan: skip this post until its file changes again
+                        posts.pop(slug, None)
+                        errors[slug] = f"{type(e).__name__}: {e}"
+            for slug in set(posts) - set(mtimes):
+                del posts[slug]
+            # Only newly parsed posts need measuring
+            sizes = {
+                slug: self._sizes[slug] if p is self._posts.get(slug) else sizeof(p)
+                for slug, p in posts.items()
+            }
+            # Publish by swapping references so readers never see a half-built index
+            self._sorted = sorted(posts.values(), key=lambda p: p.date, reverse=True)
+            self._posts = posts
+            self._mtimes = mtimes
+            self.errors = errors
+            self._sizes = sizes
+            self._posts_bytes = sum(sizes.values())
+            self.version = hashlib.blake2b(repr(sorted(mtimes.items())).encode(), digest_size=8).hexdigest()
+            self._update_related(list(posts.values()))
+        finally:
+            self._loaded = True
+            self._lock.release()
+
+    def settle(self, timeout=None):
+        """Wait for background related-posts work to finish (for builds and tools)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while (thread := self._related_thread) is not None:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+
+    def _update_related(self, posts):
+        """Queue `posts` for the related-posts updater, starting it if idle."""
+        with self._related_lock:
+            # Only the newest snapshot matters; an older queued one is dropped
+            self._related_pending = posts
+            if self._related_thread is None:
+                self._related_thread = threading.Thread(
+                    target=self._related_worker, name=f'related:{self.posts_dir}', daemon=True
+                )
+                self._related_thread.start()
+
+    def _related_worker(self):
+        while True:
+            with self._related_lock:
+                posts, self._related_pending = self._related_pending, None
+                if posts is None:
+                    self._related_thread = None
+                    return
+            try:
+                # Both publish `neighbors` by swapping in a finished dict
+                if self._related_broken:
+                    self.related_index.build(posts)
+                else:
+                    self.related_index.update(posts)
+                self._related_broken = False
+                self._related_bytes = sizeof(self.related_index)
+            except Exception:
+                # A failed update may leave the arrays half-edited; rebuild next time
+                self._related_broken = True
+                self.related_failures += 1
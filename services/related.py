@@ -0,0 +1,253 @@
+"""Related Posts via TF-IDF and Tag Overlap"""
+
+import re
+from collections import Counter, defaultdict
+from itertools import chain
+
+import numpy as np
+from scipy import sparse
+
+TOKEN_RE = re.compile(r"\b[a-z][a-z0-9']{2,}")
+
+STOPWORDS = frozenset("""
+    a about after all also an and any are as at be been but by can could did do
+    does for from had has have how i if in into is it its just like more most my
+    no not of on one or our out so some than that the their them then there these
+    they this to up us was we were what when which while who why will with would
+    you your
+""".split())
+
+
+def term_counts(text):
+    """Lowercase term counts with stopwords and very short words removed."""
+    counts = Counter(TOKEN_RE.findall(text.lower()))
+    for word in STOPWORDS.intersection(counts):
+        del counts[word]
+    return counts
+
+
+class RelatedIndex:
+    """
+    Precomputed top-k related posts for every slug.
+
+    Each post becomes one row of a sparse matrix: its L2-normalised TF-IDF
+    vector next to its L2-normalised tag vector, weighted so that the row dot
+    product is `(1 - tag_weight) * text_cosine + tag_weight * tag_cosine`.
+    Neighbours are found with blocked sparse matrix products and stored per
+    slug, so request-time lookup is a dict access.
+
+    Args:
+        k: Number of related posts kept per slug
+        tag_weight: Share of the score given to tag overlap (0-1)
+        block: Rows scored per matrix product during a build
+        rebuild_ratio: Fraction of changed posts above which `update`
+            falls back to a full rebuild (the vocabulary and IDF are only
+            refreshed by full builds)
+    """
+
+    def __init__(self, k=3, tag_weight=0.3, block=512, rebuild_ratio=0.1):
+        self.k = k
+        self.tag_weight = tag_weight
+        self.block = block
+        self.rebuild_ratio = rebuild_ratio
+        self.slugs = []
+        self.titles = {}
+        self.neighbors = {}
+        self._row = {}
+        self._sig = {}
+        self._vocab = {}
+        self._tags = {}
+        self._idf = np.zeros(0, dtype=np.float32)
+        self._matrix = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self._scores = np.zeros((0, k), dtype=np.float32)
+        self._top = np.zeros((0, k), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.slugs)
+
+    def related(self, slug):
+        """Slugs of the posts most related to `slug`, best first."""
+        return self.neighbors.get(slug, [])
+
+    # ----------------------------------------
+    # Building
+    # ----------------------------------------
+
+    def build(self, posts):
+        """Build the index from scratch over `posts`."""
+        posts = list(posts)
+        self.slugs = [p.slug for p in posts]
+        self.titles = {p.slug: p.title for p in posts}
+        self._row = {s: i for i, s in enumerate(self.slugs)}
+        self._sig = {p.slug: _signature(p) for p in posts}
+
+        docs = [term_counts(f"{p.title} {p.content}") for p in posts]
+        # Assigning ids through a defaultdict keeps vocabulary growth in C
+        self._vocab = defaultdict()
+        self._vocab.default_factory = self._vocab.__len__
+        tf = self._tf_matrix(docs, self._vocab.__getitem__)
+        self._vocab = dict(self._vocab)
+        self._tags = {}
+        for p in posts:
+            for tag in p.tags:
+                self._tags.setdefault(str(tag).lower(), len(self._tags))
+
+        df = np.bincount(tf.indices, minlength=len(self._vocab))
+        n = max(len(posts), 1)
+        self._idf = (np.log((1 + n) / (1 + df)) + 1).astype(np.float32)
+
+        self._matrix = self._weigh(tf, [p.tags for p in posts])
+        self._scores, self._top = self._score_rows(np.arange(len(posts)))
+        self._publish()
+
+    def update(self, posts):
+        """
+        Bring the index in line with `posts`, rescoring only affected rows.
+
+        A row is affected when its post changed, when one of its current
+        neighbours changed or was removed, or when a changed post now scores
+        higher than its weakest neighbour.
+        """
+        posts = list(posts)
+        current = {p.slug: p for p in posts}
+        changed = [p for p in posts if self._sig.get(p.slug) != _signature(p)]
+        removed = [s for s in self.slugs if s not in current]
+
+        if not changed and not removed:
+            return
+        if not self.slugs or len(changed) + len(removed) > self.rebuild_ratio * len(self.slugs):
+            self.build(posts)
+            return
+
+        if removed:
+            keep = np.array([i for i, s in enumerate(self.slugs) if s in current], dtype=np.int64)
+            remap = np.full(len(self.slugs), -1, dtype=np.int64)
+            remap[keep] = np.arange(len(keep))
+            self._matrix = self._matrix[keep]
+            self._scores = self._scores[keep]
+            self._top = np.where(self._top >= 0, remap[self._top], -1)[keep]
+            self.slugs = [self.slugs[i] for i in keep]
+            for s in removed:
+                self.titles.pop(s, None)
+                self._sig.pop(s, None)
+            self._row = {s: i for i, s in enumerate(self.slugs)}
+
+        added = [p for p in changed if p.slug not in self._row]
+        for p in added:
+            self._row[p.slug] = len(self.slugs)
+            self.slugs.append(p.slug)
+        if added:
+            pad = len(added)
+            self._matrix = sparse.vstack(
+                [self._matrix, sparse.csr_matrix((pad, self._matrix.shape[1]), dtype=np.float32)],
+                format='csr',
+            )
+            self._scores = np.vstack([self._scores, np.full((pad, self.k), -np.inf, dtype=np.float32)])
+            self._top = np.vstack([self._top, np.full((pad, self.k), -1, dtype=np.int64)])
+
+        rows = np.array([self._row[p.slug] for p in changed], dtype=np.int64)
+        if len(changed):
+            vecs = self._weigh(
+                self._tf_matrix([term_counts(f"{p.title} {p.content}") for p in changed]),
+                [p.tags for p in changed],
+            )
+            n = self._matrix.shape[0]
+            keep = np.ones(n, dtype=np.float32)
+            keep[rows] = 0
+            scatter = sparse.csr_matrix(
+                (np.ones(len(rows), dtype=np.float32), (rows, np.arange(len(rows)))),
+                shape=(n, len(rows)),
+            )
+            self._matrix = (sparse.diags(keep) @ self._matrix + scatter @ vecs).tocsr()
+            self._matrix.eliminate_zeros()
+            for p in changed:
+                self.titles[p.slug] = p.title
+                self._sig[p.slug] = _signature(p)
+
+        # Rows whose neighbour list references a changed or removed post
+        affected = np.isin(self._top, rows).any(axis=1) | (self._top < 0).any(axis=1)
+        affected[rows] = True
+        if len(rows):
+            sims = (self._matrix @ self._matrix[rows].T).toarray()
+            sims[rows, np.arange(len(rows))] = -np.inf
+            affected |= sims.max(axis=1) > self._scores[:, -1]
+
+        idx = np.flatnonzero(affected)
+        if len(idx):
+            self._scores[idx], self._top[idx] = self._score_rows(idx)
+        self._publish()
+
+    # ----------------------------------------
+    # Internals
+    # ----------------------------------------
+
+    def _tf_matrix(self, docs, lookup=None):
+        """
+        Sublinear term-frequency matrix.
+
+        `lookup` maps a term to its column; by default terms outside the
+        current vocabulary are dropped.
+        """
+        if lookup is None:
+            docs = [{t: c for t, c in doc.items() if t in self._vocab} for doc in docs]
+            lookup = self._vocab.__getitem__
+        indptr = np.cumsum([0, *map(len, docs)])
+        indices = np.fromiter(map(lookup, chain.from_iterable(docs)), dtype=np.int64, count=indptr[-1])
+        data = np.fromiter(chain.from_iterable(d.values() for d in docs), dtype=np.float32, count=indptr[-1])
+        return sparse.csr_matrix((1 + np.log(data), indices, indptr), shape=(len(docs), len(self._vocab)))
+
+    def _weigh(self, tf, tag_lists):
+        """Combine TF-IDF and tag vectors into normalised, weighted rows."""
+        text = _l2_normalize(tf @ sparse.diags(self._idf))
+
+        indptr, indices = [0], []
+        for tags in tag_lists:
+            indices.extend(sorted({self._tags[t] for t in (str(t).lower() for t in tags) if t in self._tags}))
+            indptr.append(len(indices))
+        tags = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.float32), np.asarray(indices, dtype=np.int64), indptr),
+            shape=(len(tag_lists), len(self._tags)),
+        )
+        tags = _l2_normalize(tags)
+
+        w = self.tag_weight
+        return sparse.hstack([np.sqrt(1 - w) * text, np.sqrt(w) * tags], format='csr', dtype=np.float32)
+
+    def _score_rows(self, rows):
+        """Top-k neighbour scores and row indices for `rows`."""
+        n = self._matrix.shape[0]
+        k = min(self.k, max(n - 1, 0))
+        scores = np.full((len(rows), self.k), -np.inf, dtype=np.float32)
+        top = np.full((len(rows), self.k), -1, dtype=np.int64)
+        if k == 0:
+            return scores, top
+
+        matrix_t = self._matrix.T.tocsr()
+        for start in range(0, len(rows), self.block):
+            blk = rows[start:start + self.block]
+            sims = (self._matrix[blk] @ matrix_t).toarray()
+            sims[np.arange(len(blk)), blk] = -np.inf
+            part = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            part_scores = np.take_along_axis(sims, part, axis=1)
+            order = np.argsort(-part_scores, axis=1)
+            top[start:start + len(blk), :k] = np.take_along_axis(part, order, axis=1)
+            scores[start:start + len(blk), :k] = np.take_along_axis(part_scores, order, axis=1)
+        return scores, top
+
+    def _publish(self):
+        """Refresh the slug -> related slugs lookup from the score arrays."""
+        self.neighbors = {
+            slug: [self.slugs[j] for j, s in zip(self._top[i], self._scores[i]) if j >= 0 and s > 0]
+            for i, slug in enumerate(self.slugs)
+        }
+
+
+def _signature(post):
+    return hash((post.title, post.content, tuple(str(t) for t in post.tags)))
+
+
+def _l2_normalize(m):
+    m = sparse.csr_matrix(m, dtype=np.float32)
+    norms = np.sqrt(np.asarray(m.multiply(m).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms) @ m
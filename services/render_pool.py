@@ -0,0 +1,282 @@
+"""Markdown Rendering in a Bounded Worker Pool"""
+
+import queue
+import threading
+import time
+from html import escape
+from multiprocessing import get_all_start_methods, get_context
+
+from monsterui.all import render_md
+
+from .assets import rewrite_asset_urls
+
+
+def render_markdown(text, assets=None):
+    """Markdown to an HTML string, asset links rewritten."""
+    html = str(render_md(text))
+    return rewrite_asset_urls(html, assets) if assets else html
+
+
+def fallback_html(text):
+    """Escaped, preformatted source shown when a render is refused or too slow."""
+    return f'<pre class="whitespace-pre-wrap">{escape(text)}</pre>'
+
+
+# Seconds a new worker may take to import the renderer and report ready
+WORKER_STARTUP = 60.0
+
+# Worker.render outcomes
+OK, FAILED, KILLED = 'ok', 'failed', 'killed'
+
+
+def _serve(conn):
+    """Worker process loop: render each (text, assets) received on `conn`."""
+    conn.send(True)
+    while True:
+        try:
+            text, assets = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            conn.send((True, render_markdown(text, assets)))
+        except Exception:
+            conn.send((False, None))
+
+
+class _Job:
+    __slots__ = ('key', 'text', 'assets', 'cache', 'submitted', 'done', 'html')
+
+    def __init__(self, key, text, assets, cache):
+        self.key, self.text, self.assets, self.cache = key, text, assets, cache
+        self.submitted = time.perf_counter()
+        self.done = threading.Event()
+        self.html = None
+
+
+class _Worker:
+    """One render process and the thread that feeds it jobs."""
+
+    def __init__(self, pool, ctx, jobs):
+        self.pool = pool
+        self.ctx = ctx
+        self.jobs = jobs
+        self.process = None
+        self.conn = None
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='render-worker', daemon=True)
+
+    def run(self):
+        self.restart()
+        self.ready.set()
+        while (job := self.jobs.get()) is not None:
+            self.pool._finish(job, *self.render(job))
+            # Replace a killed or crashed process before taking the next job
+            if self.process is None:
+                self.restart()
+        self.stop()
+
+    def restart(self):
+        try:
+            self.start()
+        except OSError:
+            pass  # retried when the next job arrives
+
+    def render(self, job):
+        """`(html, outcome)` for `job`; kills the process if it overruns."""
+        try:
+            if self.process is None or not self.process.is_alive():
+                self.start()
+            self.conn.send((job.text, job.assets))
+            if self.conn.poll(self.pool.timeout):
+                ok, html = self.conn.recv()
+                return (html, OK) if ok else (None, FAILED)
+        except (EOFError, OSError):
+            # The worker died mid-render; replace it
+            self.stop()
+            return None, FAILED
+        # Too slow: a stuck render must not keep holding this worker
+        self.stop()
+        return None, KILLED
+
+    def start(self):
+        self.conn, child = self.ctx.Pipe()
+        self.process = self.ctx.Process(target=_serve, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+        # Imports happen before the ready message, so they don't count
+        # against a render's time limit
+        try:
+            if not self.conn.poll(WORKER_STARTUP):
+                raise EOFError
+            self.conn.recv()
+        except EOFError:
+            self.stop()
+            raise OSError("render worker did not start") from None
+
+    def stop(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.join()
+            self.conn.close()
+            self.process = self.conn = None
+
+
+class RenderPool:
+    """
+    Renders markdown in worker processes so one pathological post cannot
+    hold a request thread (or the GIL) for seconds.
+
+    Renders are keyed (e.g. by site, slug and mtime) and finished HTML goes
+    into the caller's cache, so several sites can share one pool while each
+    keeps its own cache budget. Concurrent requests for a key that is
+    already rendering wait on the same job instead of starting another.
+
+    A request waits at most `timeout` for its render and otherwise gets the
+    escaped source. A render still running `timeout` seconds after it
+    started has its worker process killed and replaced, so a bad post
+    cannot tie up workers that other posts need. A key killed `max_kills`
+    times in a row has its escaped source cached (as cheap to evict), so a
+    truly pathological post stops costing workers while a normal one that
+    overran once under load gets rendered again next time. At most
+    `workers + queue` renders are pending; beyond that requests get the
+    escaped source straight away.
+
+    Workers are started with the forkserver (or spawn) method rather than
+    forked from the multi-threaded server process.
+
+    Args:
+        workers: Number of worker processes
+        timeout: Seconds a request waits for, and a worker spends on, a render
+        max_bytes: Sources larger than this are never rendered
+        queue: Renders allowed to wait for a free worker
+        max_kills: Consecutive overruns before a key's fallback is cached
+    """
+
+    def __init__(self, workers=2, timeout=2.0, max_bytes=512_000, queue=4, max_kills=3):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.max_pending = workers + queue
+        self.max_kills = max_kills
+        self._kills = {}
+        self._workers = []
+        self._queue = None
+        self._lock = threading.RLock()
+        self._inflight = {}
+        self._slow = set()
+        self.renders = 0
+        self.deduped = 0
+        self.timeouts = 0
+        self.killed = 0
+        self.rejected = 0
+        self.oversize = 0
+        self.failures = 0
+
+    def render(self, key, text, cache, assets=None):
+        """
+        HTML for `text`, rendered at most once per `key` and kept in `cache`.
+        `assets` maps asset references in the post to their hashed URLs.
+        """
+        html = cache.get(key)
+        if html is not None:
+            return html
+
+        with self._lock:
+
+            job = self._inflight.get(key)
+            if job is not None:
+                self.deduped += 1
+                # Someone already waited out the timeout on this job
+                if key in self._slow:
+                    return fallback_html(text)
+            elif len(text.encode()) > self.max_bytes:
+                self.oversize += 1
+                html = fallback_html(text)
+                cache.put(key, html)
+                return html
+            elif len(self._inflight) >= self.max_pending:
+                self.rejected += 1
+                return fallback_html(text)
+            else:
+                self.start()
+                job = _Job(key, text, assets, cache)
+                self.renders += 1
+                self._inflight[key] = job
+                self._queue.put(job)
+
+        if job.done.wait(self.timeout) and job.html is not None:
+            return job.html
+        with self._lock:
+            if not job.done.is_set():
+                self.timeouts += 1
+                self._slow.add(key)
+        return fallback_html(text)
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'in_flight': len(self._inflight),
+            'max_pending': self.max_pending,
+            'renders': self.renders,
+            'deduped': self.deduped,
+            'timeouts': self.timeouts,
+            'killed': self.killed,
+            'rejected': self.rejected,
+            'oversize': self.oversize,
+            'failures': self.failures,
+        }
+
+    def shutdown(self):
+        with self._lock:
+            if self._queue is None:
+                return
+            for _ in self._workers:
+                self._queue.put(None)
+            self._workers, self._queue = [], None
+
+    def start(self, wait=False):
+        """
+        Start the workers; slow or crashed ones are replaced as needed.
+        With `wait`, return once each has booted (or failed to).
+        """
+        with self._lock:
+            if self._queue is None:
+                self._spawn_workers()
+        if wait:
+            for w in list(self._workers):
+                w.ready.wait(WORKER_STARTUP)
+
+    def _spawn_workers(self):
+        if 'forkserver' in get_all_start_methods():
+            ctx = get_context('forkserver')
+            # The fork server imports the renderer once; replacing a
+            # killed worker is then a fork, not a fresh import
+            ctx.set_forkserver_preload([__name__])
+        else:
+            ctx = get_context('spawn')
+        self._queue = queue.SimpleQueue()
+        self._workers = [_Worker(self, ctx, self._queue) for _ in range(self.workers)]
+        for w in self._workers:
+            w.thread.start()
+
+    def _finish(self, job, html, outcome):
+        with self._lock:
+            self._inflight.pop(job.key, None)
+            self._slow.discard(job.key)
+            if outcome == OK:
+                self._kills.pop(job.key, None)
+                # Render time is what evicting this entry would cost us
+                job.cache.put(job.key, html, cost=time.perf_counter() - job.submitted)
+            elif outcome == FAILED:
+                self.failures += 1
+            else:
+                self.killed += 1
+                kills = self._kills[job.key] = self._kills.get(job.key, 0) + 1
+                if kills >= self.max_kills:
+                    del self._kills[job.key]
+                    job.cache.put(job.key, fallback_html(job.text))
+                # Keys of long-gone post versions would otherwise pile up
+                if len(self._kills) > 1024:
+                    self._kills.clear()
+            job.html = html
+            job.done.set()
@@ -0,0 +1,128 @@
+"""Host-Based Multi-Site Configuration"""
+
+import re
+
+from .assets import AssetIndex
+from .cache import Cache, MemoryBudget
+from .posts import PostIndex
+
+# Slugs are post file stems; anything else (slashes, dot-dot, odd bytes) is a probe
+SLUG_RE = re.compile(r'[A-Za-z0-9][A-Za-z0-9._-]{0,127}')
+
+
+class Site:
+    """
+    One site served by this process.
+
+    Each site has its own posts directory and post index, and its own capped
+    render and API response caches, so a large archive cannot evict a small
+    site's hot pages. The caches draw on a `MemoryBudget` that may be shared
+    with other sites; `reserve_bytes` of them are reserved for this site so
+    other sites' traffic cannot evict it below that, and the site's parsed
+    posts count against the budget as pinned memory.
+
+    Args:
+        name: Short identifier (used in cache keys and metrics)
+        hosts: Host names this site answers to
+        posts_dir: Directory of markdown posts
+        socials: List of {'name', 'url', 'icon'} social links
+        default_theme: Theme used until the visitor picks one
+        title: Site owner / default page title
+        brand: Short navbar brand text
+        tagline: Line shown under the title on the home page
+        cache_bytes: Render cache cap in bytes (API responses get a quarter
+            of this on top)
+        reserve_bytes: Cached bytes other sites can never evict
+        budget: Shared `MemoryBudget`; defaults to one of its own
+    """
+
+    def __init__(
+        self,
+        name,
+        hosts=(),
+        posts_dir='posts',
+        socials=(),
+        default_theme='cyberpunk',
+        title='',
+        brand='',
+        tagline='',
+        cache_bytes=16 * 2**20,
+        reserve_bytes=4 * 2**20,
+        budget=None,
+    ):
+        self.name = name
+        self.hosts = [h.lower() for h in hosts]
+        self.socials = list(socials)
+        self.default_theme = default_theme
+        self.title = title or name
+        self.brand = brand or self.title[:2].upper()
+        self.tagline = tagline
+        self.posts = PostIndex(posts_dir)
+        self.assets = AssetIndex(posts_dir, is_post=self.posts.__contains__)
+        self.budget = budget or MemoryBudget(2 * cache_bytes)
+        self.budget.pin(f'{name}:posts', lambda: self.posts.bytes)
+        self.budget.reserve(name, reserve_bytes)
+        self.render_cache = Cache(f'{name}:render', self.budget, cache_bytes, group=name)
+        self.api_cache = Cache(f'{name}:api', self.budget, cache_bytes // 4, group=name)
+        self.pages = Cache(f'{name}:pages', self.budget, 2**20, group=name)
+        self.unknown_slugs = Cache(f'{name}:unknown', self.budget, 2**18, group=name)
+        self.requests = 0
+        self.not_found = 0
+        self.invalid_slugs = 0
+
+    def has_post(self, slug):
+        """
+        Whether `slug` names a post.
+
+        Malformed slugs are rejected outright, and unknown ones are
+        remembered per index version, so probe floods are answered from
+        memory without rescanning the posts directory.
+        """
+        if not SLUG_RE.fullmatch(slug):
+            self.invalid_slugs += 1
+            self.not_found += 1
+            return False
+        # Throttled; without it a probed slug would stay unknown after its
+        # post is published, as long as that slug were the only traffic
+        self.posts.refresh()
+        key = (self.posts.version, slug)
+        if self.unknown_slugs.get(key) is None:
+            if slug in self.posts:
+                return True
+            self.unknown_slugs.put(key, slug)
+        self.not_found += 1
+        return False
+
+    def stats(self):
+        return {
+            'hosts': self.hosts,
+            'requests': self.requests,
+            'posts': len(self.posts),
+            'posts_bytes': self.posts.bytes,
+            'post_errors': self.posts.errors,
+            'assets': self.assets.stats(),
+            'render_cache': self.render_cache.stats(),
+            'api_cache': self.api_cache.stats(),
+            'not_found': self.not_found,
+            'invalid_slugs': self.invalid_slugs,
+            'unknown_slugs': self.unknown_slugs.stats(),
+        }
+
+
+class SiteRouter:
+    """Maps a request's Host header to a `Site`; unknown hosts get the first site."""
+
+    def __init__(self, sites):
+        self.sites = list(sites)
+        self.default = self.sites[0]
+        self._by_host = {h: s for s in self.sites for h in s.hosts}
+
+    def __iter__(self):
+        return iter(self.sites)
+
+    def resolve(self, host):
+        host = (host or '').lower()
+        # Strip the port, leaving bare IPv6 literals like [::1] intact
+        if not host.endswith(']'):
+            host = host.rsplit(':', 1)[0]
+        return self._by_host.get(host, self.default)